@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Benchmark for "get-oauth2-token.py" running against a local mock OAuth2
+authority (so no network access is needed and results are repeatable).
+
+Measures:
+
+  * `cold-start` - wall-clock time of running "get-oauth2-token.py" in a
+    fresh process with a valid access token in token cache (that is,
+    including interpreter startup and importing `msal`),
+
+  * `cache-hit` - time of `MicrosoftO365.get_token()` in already running
+    process with a valid access token in token cache,
+
+  * `refresh` - time of `MicrosoftO365.get_token()` in already running
+    process with an expired access token (and valid refresh token) in
+    token cache.
+
+For each scenario it prints min / median / max of total time and
+of each stage as reported by `--timings` (see "get-oauth2-token.py").
+
+### Installation
+
+Same as for "get-oauth2-token.py". In addition, `openssl` command is
+needed to generate self-signed certificate for the mock authority
+(`msal` insists on HTTPS).
+
+### Example
+
+    get-oauth2-token-bench.py --runs 20
+    get-oauth2-token-bench.py --runs 20 --json > results.json
+
+"""
+
+import os
+import os.path
+import sys
+import json
+import time
+import ssl
+import base64
+import shutil
+import tempfile
+import threading
+import subprocess
+import statistics
+import importlib.util
+import http.server
+import urllib.parse
+
+import logging
+logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+log = logging.getLogger(__file__)
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'get-oauth2-token.py')
+
+MOCK_TENANT = 'mock-tenant'
+MOCK_CLIENT_ID = 'mock-client-id'
+MOCK_CLIENT_SECRET = 'mock-client-secret'
+MOCK_USERNAME = 'john.doe@example.com'
+MOCK_REFRESH_TOKEN = 'mock-refresh-token'
+
+
+def b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+class MockAuthorityRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Handles OpenID discovery and token requests the way `msal` expects.
+    """
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urllib.parse.urlparse(self.path).path
+        if path == '/%s/v2.0/.well-known/openid-configuration' % MOCK_TENANT:
+            self.reply(200, self.server.openid_configuration())
+        else:
+            self.reply(404, { 'error' : 'not_found', 'error_description' : 'No such endpoint: %s' % path })
+
+    def do_POST(self):
+        path = urllib.parse.urlparse(self.path).path
+        length = int(self.headers.get('Content-Length', 0))
+        request = urllib.parse.parse_qs(self.rfile.read(length).decode('utf8'))
+        if path != '/%s/oauth2/v2.0/token' % MOCK_TENANT:
+            self.reply(404, { 'error' : 'not_found', 'error_description' : 'No such endpoint: %s' % path })
+        elif request.get('grant_type') != ['refresh_token'] or request.get('refresh_token') != [MOCK_REFRESH_TOKEN]:
+            self.reply(400, { 'error' : 'invalid_grant', 'error_description' : 'Invalid refresh token' })
+        else:
+            self.reply(200, self.server.token(request.get('client_id', [MOCK_CLIENT_ID])[0], request.get('scope', [''])[0]))
+
+
+class MockAuthority(http.server.ThreadingHTTPServer):
+    """
+    Local mock of Microsoft identity platform. It serves OpenID discovery
+    document and token endpoint (refresh token grant only) over HTTPS
+    on localhost. Access tokens are valid for `expires_in` seconds.
+    """
+    def __init__(self, certfile, keyfile, expires_in = 3600):
+        super().__init__(('127.0.0.1', 0), MockAuthorityRequestHandler)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+        self.expires_in = expires_in
+        self._issued = 0
+
+    @property
+    def authority(self):
+        return 'https://localhost:%d/%s' % (self.server_address[1], MOCK_TENANT)
+
+    def openid_configuration(self):
+        return {
+            'issuer' : '%s/v2.0' % self.authority,
+            'authorization_endpoint' : '%s/oauth2/v2.0/authorize' % self.authority,
+            'token_endpoint' : '%s/oauth2/v2.0/token' % self.authority,
+            'device_authorization_endpoint' : '%s/oauth2/v2.0/devicecode' % self.authority,
+        }
+
+    def token(self, client_id, scope):
+        self._issued += 1
+        now = int(time.time())
+        claims = {
+            'iss' : '%s/v2.0' % self.authority,
+            'aud' : client_id,
+            'iat' : now,
+            'nbf' : now,
+            'exp' : now + 3600,
+            'sub' : 'mock-subject',
+            'oid' : 'mock-object-id',
+            'tid' : MOCK_TENANT,
+            'preferred_username' : MOCK_USERNAME,
+        }
+        id_token = '.'.join([ b64url(json.dumps(part).encode('utf8')) for part in ({ 'alg' : 'none', 'typ' : 'JWT' }, claims) ]) + '.'
+        client_info = b64url(json.dumps({ 'uid' : 'mock-object-id', 'utid' : MOCK_TENANT }).encode('utf8'))
+        return {
+            'token_type' : 'Bearer',
+            'scope' : scope,
+            'expires_in' : self.expires_in,
+            'ext_expires_in' : self.expires_in,
+            'access_token' : 'mock-access-token-%d' % self._issued,
+            'refresh_token' : MOCK_REFRESH_TOKEN,
+            'id_token' : id_token,
+            'client_info' : client_info,
+        }
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+def make_certificate(directory):
+    """
+    Generate self-signed certificate for localhost in directory, return
+    paths to certificate and key.
+    """
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+                    '-keyout', keyfile, '-out', certfile, '-days', '1',
+                    '-subj', '/CN=localhost',
+                    '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1'],
+                   check=True, capture_output=True)
+    return certfile, keyfile
+
+
+def load_script():
+    """
+    Load "get-oauth2-token.py" as a module and return it.
+    """
+    spec = importlib.util.spec_from_file_location('get_oauth2_token', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Benchmark(object):
+    def __init__(self, directory, runs):
+        self._directory = directory
+        self._runs = runs
+        certfile, keyfile = make_certificate(directory)
+        # Make `requests` (used by `msal`) trust the mock authority, both
+        # in this process and in spawned ones.
+        os.environ['REQUESTS_CA_BUNDLE'] = certfile
+        os.environ['NO_PROXY'] = 'localhost,127.0.0.1'
+        self._authority = MockAuthority(certfile, keyfile)
+        self._authority.start()
+        self._script = load_script()
+        self._fresh_cache = self._seed_cache('fresh.json', 3600)
+        # msal considers access token expiring within 5 minutes expired
+        self._expired_cache = self._seed_cache('expired.json', 60)
+
+    def close(self):
+        self._authority.shutdown()
+        self._authority.server_close()
+
+    def _provider(self, token_cache_file, timings):
+        return self._script.MicrosoftO365(client_id = MOCK_CLIENT_ID,
+                                          client_credential = MOCK_CLIENT_SECRET,
+                                          token_cache_file = token_cache_file,
+                                          authority = self._authority.authority,
+                                          validate_authority = False,
+                                          timings = timings)
+
+    def _seed_cache(self, name, expires_in):
+        """
+        Create token cache with tokens valid for expires_in seconds,
+        return path to it.
+        """
+        token_cache_file = os.path.join(self._directory, name)
+        self._authority.expires_in = expires_in
+        with self._provider(token_cache_file, None) as provider:
+            provider.get_token_by_refresh_token(MOCK_REFRESH_TOKEN)
+        self._authority.expires_in = 3600
+        return token_cache_file
+
+    def _copy_cache(self, token_cache_file):
+        copy = os.path.join(self._directory, 'run.json')
+        shutil.copyfile(token_cache_file, copy)
+        return copy
+
+    def cold_start(self):
+        timings_file = os.path.join(self._directory, 'timings.jsonl')
+        results = []
+        for run in range(self._runs):
+            if os.path.exists(timings_file):
+                os.unlink(timings_file)
+            token_cache_file = self._copy_cache(self._fresh_cache)
+            started = time.perf_counter()
+            subprocess.run([sys.executable, SCRIPT,
+                            '--client_id', MOCK_CLIENT_ID,
+                            '--client_secret', MOCK_CLIENT_SECRET,
+                            '--authority', self._authority.authority,
+                            '--no-validate-authority',
+                            '--cache', token_cache_file,
+                            '--timings', timings_file],
+                           check=True, stdout=subprocess.DEVNULL, stdin=subprocess.DEVNULL)
+            elapsed = time.perf_counter() - started
+            with open(timings_file) as timings_io:
+                stages = json.loads(timings_io.readline())['stages']
+            results.append((elapsed, stages))
+        return results
+
+    def _in_process(self, token_cache_file):
+        results = []
+        for run in range(self._runs):
+            timings = self._script.Timings()
+            copy = self._copy_cache(token_cache_file)
+            started = time.perf_counter()
+            with self._provider(copy, timings) as provider:
+                provider.get_token()
+            elapsed = time.perf_counter() - started
+            results.append((elapsed, timings.stages()))
+        return results
+
+    def cache_hit(self):
+        return self._in_process(self._fresh_cache)
+
+    def refresh(self):
+        return self._in_process(self._expired_cache)
+
+    def run(self):
+        return {
+            'cold-start' : summarize(self.cold_start()),
+            'cache-hit' : summarize(self.cache_hit()),
+            'refresh' : summarize(self.refresh()),
+        }
+
+
+def summarize(results):
+    """
+    Summarize list of (elapsed, stages) tuples to a dictionary mapping
+    `total` and each stage name to min / median / max time. Stages
+    occurring multiple times in a run are summed up.
+    """
+    samples = { 'total' : [ elapsed for elapsed, stages in results ] }
+    for elapsed, stages in results:
+        per_run = {}
+        for stage in stages:
+            per_run[stage['stage']] = per_run.get(stage['stage'], 0) + stage['seconds']
+        for stage, seconds in per_run.items():
+            samples.setdefault(stage, []).append(seconds)
+    return { stage : { 'runs' : len(values), 'min' : min(values), 'median' : statistics.median(values), 'max' : max(values) }
+             for stage, values in samples.items() }
+
+
+def print_summary(summary):
+    for scenario, stages in summary.items():
+        print(scenario)
+        for stage, stats in stages.items():
+            print("    %-24s %4d runs  min %8.2f ms  median %8.2f ms  max %8.2f ms" % (
+                stage, stats['runs'], stats['min'] * 1000, stats['median'] * 1000, stats['max'] * 1000))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", metavar="N", type=int,
+                        dest='runs', default=10,
+                        help="Number of runs of each scenario, defaults to 10")
+    parser.add_argument("--json",
+                        dest='json', action="store_const", const=True, default=False,
+                        help="Output results as JSON")
+
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='get-oauth2-token-bench-') as directory:
+        benchmark = Benchmark(directory, options.runs)
+        try:
+            summary = benchmark.run()
+        finally:
+            benchmark.close()
+
+    if options.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
@@ -22,8 +22,26 @@ Alternatively:
 
     apt-get install python3-msal python3-secretstorage
 
+### Timings
+
+To find out where the time is spent, pass `--timings FILE` (or
+`--timings -` for stderr). Durations of individual stages (startup,
+token cache (de)serialization, `acquire_token_silent`, refresh token
+exchange, secret lookup and so on) are then appended to given file as
+a single line of JSON.
+
+See "get-oauth2-token-bench.py" for a benchmark running against a local
+mock authority.
+
 """
 
+#
+# Record start time as early as possible so --timings can report
+# how long it took to get going (mostly importing msal).
+#
+import time
+STARTED = time.perf_counter()
+
 #
 # Defaults
 #
@@ -40,6 +58,8 @@ import os
 import os.path
 import sys
 import json
+import atexit
+import contextlib
 
 try:
     import ipdb
@@ -83,36 +103,112 @@ except ImportError:
     logging.error("Failed to import `msal`, please `pip3 install msal`")
     sys.exit(1)
 
-try:
-    import secretstorage
-except ImportError:
-    logging.error("Failed to import `secretstorage`, please `pip3 install secretstorage`")
-    sys.exit(1)
+#
+# Secrets are fetched using "get-secret.py" (which lives next to this
+# script) so both scripts share the same code. It is loaded only when
+# needed so this script works standalone with --cache.
+#
+_get_secret = None
+
+def get_secrets(secret_titles):
+    """
+    Fetch and return secrets labelled secret_titles from default secret
+    storage using `get_secrets()` from "get-secret.py".
+    """
+    global _get_secret
+    if _get_secret is None:
+        import importlib.util
+        path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'get-secret.py')
+        if not os.path.exists(path):
+            raise Exception("Cannot fetch secrets, %s not found (it must live next to this script)" % path)
+        spec = importlib.util.spec_from_file_location('get_secret', path)
+        _get_secret = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(_get_secret)
+    return _get_secret.get_secrets(secret_titles)
+
+
+
+class Timings(object):
+    """
+    Collects durations of individual stages of token acquisition.
+    """
+    def __init__(self):
+        self._stages = []
+
+    def record(self, stage, seconds):
+        self._stages.append({ 'stage' : stage, 'seconds' : seconds })
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        """
+        Context manager recording how long it took to execute its body
+        as given stage.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def stages(self):
+        return list(self._stages)
+
+    def as_json(self):
+        return json.dumps({ 'stages' : self._stages, 'total' : sum([ stage['seconds'] for stage in self._stages ]) })
+
+    def write(self, output):
+        """
+        Append timings as a single line of JSON to file output,
+        - means stderr.
+        """
+        if output == '-':
+            print(self.as_json(), file=sys.stderr)
+        else:
+            with open(output, 'a') as output_io:
+                output_io.write(self.as_json() + '\n')
+
+
+class NullTimings(object):
+    """
+    Timings recorder that records nothing, used when timings are not
+    requested.
+    """
+    def record(self, stage, seconds):
+        pass
 
+    @contextlib.contextmanager
+    def stage(self, stage):
+        yield
 
 
 class MicrosoftO365(object):
-    def __init__(self, client_id = DEFAULT_OAUTH2_CLIENT_ID, client_credential = None, scopes = DEFAULT_OAUTH2_SCOPES, token_cache_file = None):
+    def __init__(self, client_id = DEFAULT_OAUTH2_CLIENT_ID, client_credential = None, scopes = DEFAULT_OAUTH2_SCOPES, token_cache_file = None, authority = None, validate_authority = True, timings = None):
 
         self._scopes = scopes
         self._token_cache_file = token_cache_file
+        self._timings = timings if timings is not None else NullTimings()
         self._token_cache = msal.SerializableTokenCache()
         if self._token_cache_file is not None:
             if os.path.exists(self._token_cache_file):
-                self._token_cache.deserialize(open(self._token_cache_file, "r").read())
+                with self._timings.stage('cache_deserialize'):
+                    self._token_cache.deserialize(open(self._token_cache_file, "r").read())
 
-        self._app = msal.ConfidentialClientApplication(
-                            client_id = client_id,
-                            client_credential = client_credential,
-                            token_cache = self._token_cache)
+        with self._timings.stage('app_init'):
+            self._app = msal.ConfidentialClientApplication(
+                                client_id = client_id,
+                                client_credential = client_credential,
+                                authority = authority,
+                                validate_authority = validate_authority,
+                                token_cache = self._token_cache)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self._token_cache_file is not None and self._token_cache.has_state_changed:
-            with open(self._token_cache_file, "w") as token_cache_io:
-                token_cache_io.write(self._token_cache.serialize())
+            with self._timings.stage('cache_serialize'):
+                with open(self._token_cache_file, "w") as token_cache_io:
+                    token_cache_io.write(self._token_cache.serialize())
 
     def get_token_by_refresh_token(self, refresh_token, interactive = False):
         """
@@ -124,7 +220,8 @@ class MicrosoftO365(object):
         If interactive is `True`, guide user through the
         authentication/authorization process.
         """
-        reply = self._app.acquire_token_by_refresh_token(refresh_token=refresh_token, scopes=self._scopes)
+        with self._timings.stage('refresh_token_exchange'):
+            reply = self._app.acquire_token_by_refresh_token(refresh_token=refresh_token, scopes=self._scopes)
         if not reply:
             if interactive:
                 auth_request = self._app.initiate_auth_code_flow(scopes = self._scopes, redirect_uri = 'https://login.microsoftonline.com/common/oauth2/nativeclient')
@@ -143,7 +240,8 @@ address bar here (and press enter):""")
                     key, value = key_and_value.split('=')
                     auth_response[key] = value
 
-                reply = self._app.acquire_token_by_auth_code_flow(auth_code_flow=auth_request, auth_response=auth_response, scopes = self._scopes)
+                with self._timings.stage('auth_code_exchange'):
+                    reply = self._app.acquire_token_by_auth_code_flow(auth_code_flow=auth_request, auth_response=auth_response, scopes = self._scopes)
                 if "error" in reply:
                     raise Exception(reply["error_description"])
             else:
@@ -164,7 +262,17 @@ address bar here (and press enter):""")
         authentication/authorization process.
         """
 
-        reply = self._app.acquire_token_silent(self._scopes, account=None)
+        accounts = self._app.get_accounts()
+        account = accounts[0] if len(accounts) > 0 else None
+        # If cached access token has expired, acquire_token_silent() exchanges
+        # refresh token for a new one. Newer msal tells us where the token
+        # came from, so record such calls as refresh token exchange.
+        started = time.perf_counter()
+        reply = self._app.acquire_token_silent(self._scopes, account=account)
+        if reply and reply.get('token_source') == 'identity_provider':
+            self._timings.record('refresh_token_exchange', time.perf_counter() - started)
+        else:
+            self._timings.record('acquire_token_silent', time.perf_counter() - started)
         if reply:
             access_token = reply['access_token']
         else:
@@ -191,13 +299,9 @@ address bar here (and press enter):""")
         CAVEAT: For now, it only supports refresh token stored in Evolution
         format.
         """
-        secrets = secretstorage.get_default_collection(secretstorage.dbus_init())
-        refresh_token = None
-        for secret in secrets.search_items({ 'Title' : secret_title }):
-            refresh_token_json = json.loads(secret.get_secret().decode('utf8'))
-            refresh_token = refresh_token_json['refresh_token']
-        if refresh_token is None:
-            raise Exception("No such secret: %s" % secret_title)
+        with self._timings.stage('secret_lookup'):
+            refresh_token_json = json.loads(get_secrets([ secret_title ])[secret_title])
+        refresh_token = refresh_token_json['refresh_token']
         return self.get_token_by_refresh_token(refresh_token, interactive)
 
     def get_username(self):
@@ -235,6 +339,15 @@ if __name__ == '__main__':
     parser.add_argument("--secret",
                         dest='secret', default=None,
                         help="Name (title) of secret service entry containing the refresh token. Either --secret or --cache is allowed, not both.")
+    parser.add_argument("--authority", metavar="URL",
+                        dest='authority', default=None,
+                        help="Authority URL, defaults to https://login.microsoftonline.com/common")
+    parser.add_argument("--no-validate-authority",
+                        dest='validate_authority', action="store_const", const=False, default=True,
+                        help="Do not validate authority (needed for authorities not known to Microsoft, such as a local mock)")
+    parser.add_argument("--timings", metavar="FILE",
+                        dest='timings', default=None,
+                        help="Append durations of individual stages as JSON to given file, - means stderr")
     parser.add_argument("--debug",
                         action="store_const", const=True, default=False,
                         help="Enable debugging")
@@ -252,11 +365,20 @@ if __name__ == '__main__':
         sys.excepthook = excepthook
         sys.breakpointhook = breakpointhook
 
+    timings = None
+    if options.timings is not None:
+        timings = Timings()
+        timings.record('startup', time.perf_counter() - STARTED)
+        atexit.register(timings.write, options.timings)
+
     config = {
         'client_id' : options.client_id,
         'client_credential' : options.client_credential,
         'scopes' : options.scopes,
-        'token_cache_file' : options.token_cache_file
+        'token_cache_file' : options.token_cache_file,
+        'authority' : options.authority,
+        'validate_authority' : options.validate_authority,
+        'timings' : timings
     }
 
     with MicrosoftO365(**config) as provider:
@@ -18,6 +18,48 @@ Alternatively:
 
     apt-get install python3-secretstorage
 
+### Usage
+
+To get a single secret:
+
+    get-secret.py --name "My Password"
+
+To get multiple secrets at once (over a single D-Bus connection), pass
+multiple `--name` options or a file with names (one per line) and pick
+an output format:
+
+    get-secret.py --name "DB Password" --name "API Key" --format json
+    get-secret.py --names names.txt --format export
+    get-secret.py --names names.txt --format env -o secrets.env
+
+With `export` and `env` formats, variable name is derived from the
+title by upper-casing it and replacing all non-alphanumeric characters
+by underscore (so "API Key" becomes `API_KEY`).
+
+### Agent
+
+For services that read the same secrets over and over, `get-secret.py`
+may run as an agent:
+
+    get-secret.py --agent --ttl 600 &
+
+The agent keeps decrypted secrets in locked (non-swappable, excluded from
+core dumps) memory for `--ttl` seconds and answers lookups over an UNIX
+socket accessible only to the user running it. Secrets not in the cache
+are looked up in secret storage (over agent's D-Bus connection) and
+cached.
+
+When agent's socket exists, `get-secret.py` asks the agent first and
+falls back to secret storage only if the agent cannot be reached.
+Use `--socket` to specify socket path (defaults to
+`$XDG_RUNTIME_DIR/get-secret/agent.sock`). To drop all cached secrets:
+
+    get-secret.py --flush
+
+CAVEAT: secrets necessarily pass through Python's (swappable) heap while
+being fetched from secret storage or sent over the socket. Only the
+cache itself is kept in locked memory.
+
 """
 
 #
@@ -30,6 +72,19 @@ import os
 import os.path
 import sys
 import json
+import re
+import shlex
+import time
+import stat
+import mmap
+import ctypes
+import ctypes.util
+import signal
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
 
 try:
     import ipdb
@@ -75,26 +130,477 @@ except ImportError:
 
 
 
+class NoSuchSecretError(Exception):
+    """
+    Raised when one or more secrets are not found in secret storage.
+    """
+    def __init__(self, secret_titles):
+        super().__init__("No such secret: %s" % ', '.join(secret_titles))
+        self.secret_titles = secret_titles
+
+def get_secrets(secret_titles, collection = None):
+    """
+    Fetch and return secrets (passwords) labelled secret_titles from
+    default secret storage as a dictionary mapping title to secret.
+
+    All secrets are looked up over a single D-Bus connection (and the
+    collection is unlocked at most once). If collection is given, it is
+    used instead of the default one.
+
+    If any of the secrets is not found, raise an exception listing
+    all missing titles.
+    """
+    if collection is None:
+        collection = secretstorage.get_default_collection(secretstorage.dbus_init())
+    if collection.is_locked():
+        if collection.unlock():
+            raise Exception("Secret storage locked (unlock prompt dismissed)")
+    secrets = {}
+    for secret_title in secret_titles:
+        if secret_title in secrets:
+            continue
+        for secret in collection.search_items({ 'Title' : secret_title }):
+            secrets[secret_title] = secret.get_secret().decode('utf8')
+            break
+    missing = [ secret_title for secret_title in secret_titles if secret_title not in secrets ]
+    if len(missing) > 0:
+        raise NoSuchSecretError(missing)
+    return secrets
+
 def get_secret(secret_title):
     """
     Fetch and return secret (password) labelled secret_title from default
     secret storage.
     """
-    secrets = secretstorage.get_default_collection(secretstorage.dbus_init())
-    for secret in secrets.search_items({ 'Title' : secret_title }):
-        return secret.get_secret().decode('utf8')
-    raise Exception("No such secret: %s" % secret_title)
+    return get_secrets([ secret_title ])[secret_title]
+
+def read_names(path):
+    """
+    Read and return list of secret names (titles) from file at path,
+    one per line. Empty lines and lines starting with # are ignored.
+    If path is -, names are read from stdin.
+    """
+    if path == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(path, 'r') as names_io:
+            lines = names_io.readlines()
+    names = []
+    for line in lines:
+        line = line.strip()
+        if len(line) > 0 and not line.startswith('#'):
+            names.append(line)
+    return names
+
+def variable_name(secret_title):
+    """
+    Return shell variable name for secret labelled secret_title, i.e.,
+    title upper-cased with all non-alphanumeric characters replaced
+    by underscore.
+    """
+    name = re.sub('[^A-Z0-9_]', '_', secret_title.upper())
+    if len(name) == 0 or name[0].isdigit():
+        name = '_' + name
+    return name
+
+def variables(secrets):
+    """
+    Return dictionary mapping variable name to secret for secrets (a
+    dictionary mapping title to secret). If two or more titles map to
+    the same variable name, raise an exception.
+    """
+    titles = {}
+    for title in secrets:
+        titles.setdefault(variable_name(title), []).append(title)
+    conflicts = [ ' and '.join(conflicting) for conflicting in titles.values() if len(conflicting) > 1 ]
+    if len(conflicts) > 0:
+        raise Exception("Secrets map to the same variable name: %s" % '; '.join(conflicts))
+    return { name : secrets[conflicting[0]] for name, conflicting in titles.items() }
+
+def format_secrets(secrets, format, secret_titles = None):
+    """
+    Format secrets (a dictionary mapping title to secret) as a string
+    in given format:
+
+      * `plain`  - secrets only, one per line, one line for each title
+                   in secret_titles (so repeated titles are repeated)
+      * `json`   - JSON object mapping title to secret
+      * `export` - shell `export NAME=secret` lines
+      * `env`    - `NAME=secret` lines (env-file)
+    """
+    if format == 'plain':
+        if secret_titles is None:
+            secret_titles = secrets.keys()
+        return '\n'.join([ secrets[secret_title] for secret_title in secret_titles ])
+    elif format == 'json':
+        return json.dumps(secrets, indent=2)
+    elif format == 'export':
+        return '\n'.join([ "export %s=%s" % (name, shlex.quote(secret)) for name, secret in variables(secrets).items() ])
+    elif format == 'env':
+        lines = []
+        for title, secret in secrets.items():
+            if '\n' in secret:
+                raise Exception("Secret %s contains newline, cannot write it to env-file" % title)
+        for name, secret in variables(secrets).items():
+            lines.append("%s=%s" % (name, secret))
+        return '\n'.join(lines)
+    else:
+        raise Exception("Invalid format: %s" % format)
+
+
+#
+# Agent support
+#
+
+DEFAULT_AGENT_TTL = 300
+DEFAULT_AGENT_CACHE_SIZE = 64 * 1024
+DEFAULT_AGENT_TIMEOUT = 5
+
+class AgentUnavailable(Exception):
+    """
+    Raised when agent cannot be reached, does not reply properly or
+    fails to talk to secret storage. Callers should fall back to secret
+    storage.
+    """
+    pass
+
+def default_socket_path():
+    """
+    Return default path of agent's socket, i.e.,
+    `$XDG_RUNTIME_DIR/get-secret/agent.sock` or
+    `/tmp/get-secret-$UID/agent.sock` if `XDG_RUNTIME_DIR` is not set.
+    """
+    runtime_dir = os.getenv('XDG_RUNTIME_DIR')
+    if runtime_dir is None:
+        socket_dir = os.path.join(tempfile.gettempdir(), 'get-secret-%d' % os.getuid())
+    else:
+        socket_dir = os.path.join(runtime_dir, 'get-secret')
+    return os.path.join(socket_dir, 'agent.sock')
+
+def peer_uid(sock):
+    """
+    Return UID of process on the other end of UNIX socket sock.
+    """
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    pid, uid, gid = struct.unpack('3i', creds)
+    return uid
+
+class SecretCache(object):
+    """
+    Cache of decrypted secrets with per-entry time-to-live.
+
+    Secrets are kept in a fixed-size buffer that is locked in memory
+    (so it is never swapped out) and excluded from core dumps. Removed
+    and expired secrets are overwritten with zeros.
+    """
+    def __init__(self, ttl = DEFAULT_AGENT_TTL, size = DEFAULT_AGENT_CACHE_SIZE):
+        self._ttl = ttl
+        self._size = size
+        self._buffer = mmap.mmap(-1, size)
+        self._entries = {} # title -> (offset, length, expires)
+        self._used = 0
+        self._lock_buffer()
+
+    def _lock_buffer(self):
+        if hasattr(mmap, 'MADV_DONTDUMP'):
+            self._buffer.madvise(mmap.MADV_DONTDUMP)
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        pointer = ctypes.c_char.from_buffer(self._buffer)
+        address = ctypes.addressof(pointer)
+        del pointer
+        if libc.mlock(ctypes.c_void_p(address), ctypes.c_size_t(self._size)) != 0:
+            log.warning("Failed to lock cache memory, secrets may be swapped out: %s", os.strerror(ctypes.get_errno()))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, secret_title):
+        """
+        Return cached secret labelled secret_title or `None` if not
+        cached (or expired).
+        """
+        if secret_title not in self._entries:
+            return None
+        offset, length, expires = self._entries[secret_title]
+        if expires <= time.monotonic():
+            self._remove(secret_title)
+            return None
+        return self._buffer[offset:offset+length].decode('utf8')
+
+    def put(self, secret_title, secret):
+        """
+        Cache secret labelled secret_title. If there's no space left
+        in the cache (even after removing expired secrets), secret is
+        not cached.
+        """
+        data = secret.encode('utf8')
+        if secret_title in self._entries:
+            self._remove(secret_title)
+        if self._used + len(data) > self._size:
+            self.expire()
+            self._compact()
+        if self._used + len(data) > self._size:
+            log.warning("Cache full, not caching secret: %s", secret_title)
+            return
+        self._buffer[self._used:self._used+len(data)] = data
+        self._entries[secret_title] = (self._used, len(data), time.monotonic() + self._ttl)
+        self._used += len(data)
+
+    def expire(self):
+        """
+        Remove all expired secrets.
+        """
+        now = time.monotonic()
+        for secret_title, (offset, length, expires) in list(self._entries.items()):
+            if expires <= now:
+                self._remove(secret_title)
+
+    def flush(self):
+        """
+        Remove all secrets.
+        """
+        self._buffer[0:self._size] = bytes(self._size)
+        self._entries = {}
+        self._used = 0
+
+    def _remove(self, secret_title):
+        offset, length, expires = self._entries.pop(secret_title)
+        self._buffer[offset:offset+length] = bytes(length)
+
+    def _compact(self):
+        used = 0
+        for secret_title, (offset, length, expires) in sorted(self._entries.items(), key=lambda entry: entry[1][0]):
+            if offset != used:
+                self._buffer.move(used, offset, length)
+            self._entries[secret_title] = (used, length, expires)
+            used += length
+        self._buffer[used:self._size] = bytes(self._size - used)
+        self._used = used
+
+class SecretAgentRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handles a single agent request. Request is a single line of JSON,
+    either `{"op": "get", "names": [...]}` or `{"op": "flush"}`. Reply
+    is a single line of JSON, either `{"secrets": {...}}`, `{"flushed": N}`,
+    `{"missing": [...], "error": "..."}` (some secrets not found) or
+    `{"error": "..."}` (anything else went wrong).
+
+    Clients not sending request within `timeout` seconds are
+    disconnected.
+    """
+    timeout = DEFAULT_AGENT_TIMEOUT
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline(65536))
+        except (OSError, ValueError) as e:
+            log.debug("Invalid request: %s", e)
+            return
+        try:
+            if request['op'] == 'get':
+                reply = { 'secrets' : self.server.get_secrets(request['names']) }
+            elif request['op'] == 'flush':
+                reply = { 'flushed' : self.server.flush() }
+            else:
+                raise Exception("Invalid operation: %s" % request['op'])
+        except NoSuchSecretError as e:
+            reply = { 'missing' : e.secret_titles, 'error' : str(e) }
+        except Exception as e:
+            reply = { 'error' : str(e) }
+        try:
+            self.wfile.write((json.dumps(reply) + '\n').encode('utf8'))
+        except OSError as e:
+            log.debug("Failed to send reply: %s", e)
+
+class SecretAgent(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Agent serving secrets from cache (see `SecretCache`) over an UNIX
+    socket. Secrets not in the cache are looked up in default secret
+    storage and cached.
+
+    Only processes running under the same user as the agent are
+    served. Each client is served in its own thread so one stuck client
+    does not block others.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path = None, ttl = DEFAULT_AGENT_TTL):
+        if socket_path is None:
+            socket_path = default_socket_path()
+        self._cache = SecretCache(ttl)
+        self._cache_lock = threading.Lock()
+        self._collection = None
+        self._collection_lock = threading.Lock()
+        self._prepare_socket_path(socket_path)
+        umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, SecretAgentRequestHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(socket_path, 0o600)
+
+    @staticmethod
+    def _prepare_socket_path(socket_path):
+        socket_dir = os.path.dirname(os.path.abspath(socket_path))
+        if not os.path.exists(socket_dir):
+            os.makedirs(socket_dir, mode=0o700)
+        socket_dir_stat = os.stat(socket_dir)
+        if socket_dir_stat.st_uid != os.getuid() or stat.S_IMODE(socket_dir_stat.st_mode) & 0o077 != 0:
+            raise Exception("Socket directory %s must be owned by current user and not accessible by others" % socket_dir)
+        if os.path.exists(socket_path):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                try:
+                    sock.connect(socket_path)
+                except ConnectionRefusedError:
+                    # Stale socket left behind by an agent that died
+                    os.unlink(socket_path)
+                else:
+                    raise Exception("Agent already running on %s" % socket_path)
+
+    def verify_request(self, request, client_address):
+        uid = peer_uid(request)
+        if uid != os.getuid():
+            log.warning("Refusing request from UID %d", uid)
+            return False
+        return True
+
+    def get_secrets(self, secret_titles):
+        """
+        Return secrets labelled secret_titles as dictionary mapping
+        title to secret, from cache if possible.
+
+        Secrets not in the cache are fetched from secret storage with
+        cache unlocked, so clients asking for cached secrets are served
+        even while secret storage is slow (or waiting for user to unlock
+        it).
+        """
+        secrets, missing = self._get_cached_secrets(secret_titles)
+        if len(missing) > 0:
+            with self._collection_lock:
+                # Another client may have fetched them in the meantime
+                cached, missing = self._get_cached_secrets(missing)
+                secrets.update(cached)
+                if len(missing) > 0:
+                    fetched = self._fetch_secrets(missing)
+                    with self._cache_lock:
+                        for secret_title, secret in fetched.items():
+                            self._cache.put(secret_title, secret)
+                    secrets.update(fetched)
+        return { secret_title : secrets[secret_title] for secret_title in secret_titles }
+
+    def _get_cached_secrets(self, secret_titles):
+        secrets = {}
+        missing = []
+        with self._cache_lock:
+            self._cache.expire()
+            for secret_title in secret_titles:
+                secret = self._cache.get(secret_title)
+                if secret is None:
+                    if secret_title not in missing:
+                        missing.append(secret_title)
+                else:
+                    secrets[secret_title] = secret
+        return secrets, missing
+
+    def _fetch_secrets(self, secret_titles):
+        # Must be called with _collection_lock held
+        if self._collection is None:
+            self._collection = secretstorage.get_default_collection(secretstorage.dbus_init())
+        try:
+            return get_secrets(secret_titles, self._collection)
+        except (secretstorage.SecretServiceNotAvailableException, OSError):
+            # Connection to secret service is gone, reconnect on next request
+            self._collection = None
+            raise
+
+    def flush(self):
+        """
+        Remove all secrets from cache, return number of secrets removed.
+        """
+        with self._cache_lock:
+            flushed = len(self._cache)
+            self._cache.flush()
+            return flushed
+
+    def server_close(self):
+        super().server_close()
+        with self._cache_lock:
+            self._cache.flush()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+def agent_request(request, socket_path = None, timeout = DEFAULT_AGENT_TIMEOUT):
+    """
+    Send request to agent listening on socket_path and return its
+    reply. Raise `NoSuchSecretError` if agent reports some secrets
+    were not found and `AgentUnavailable` if anything else goes wrong.
+    """
+    if socket_path is None:
+        socket_path = default_socket_path()
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            if peer_uid(sock) != os.getuid():
+                raise PermissionError("Agent on %s runs under different user" % socket_path)
+            sock.sendall((json.dumps(request) + '\n').encode('utf8'))
+            reply = json.loads(sock.makefile('rb').readline())
+    except (OSError, ValueError) as e:
+        raise AgentUnavailable("Agent on %s not available: %s" % (socket_path, e)) from e
+    if 'missing' in reply:
+        raise NoSuchSecretError(reply['missing'])
+    if 'error' in reply:
+        raise AgentUnavailable("Agent on %s failed: %s" % (socket_path, reply['error']))
+    return reply
+
+def get_secrets_from_agent(secret_titles, socket_path = None, timeout = DEFAULT_AGENT_TIMEOUT):
+    """
+    Fetch and return secrets labelled secret_titles from agent
+    listening on socket_path as dictionary mapping title to secret.
+    See `agent_request()` for exceptions raised.
+    """
+    return agent_request({ 'op' : 'get', 'names' : list(secret_titles) }, socket_path, timeout)['secrets']
+
+def run_agent(socket_path = None, ttl = DEFAULT_AGENT_TTL):
+    """
+    Run agent listening on socket_path until terminated.
+    """
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with SecretAgent(socket_path, ttl) as agent:
+        log.info("Agent listening on %s", agent.server_address)
+        try:
+            agent.serve_forever()
+        except KeyboardInterrupt:
+            pass
 
 if __name__ == '__main__':
     import argparse
     import sys
-    parser = argparse.ArgumentParser(description=__doc__)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument("-o", "--output", metavar="FILE",
                         dest='output', default='-',
-                        help="Where to write secret, defaults to - (stdout)")
+                        help="Where to write secret(s), defaults to - (stdout)")
     parser.add_argument("--name",
-                        dest='secret', default=None,
-                        help="Name (title) of secret service entry containing the refresh token. Either --secret or --cache is allowed, not both.")
+                        dest='secrets', default=[], action='append',
+                        help="Name (title) of secret service entry. May be given multiple times.")
+    parser.add_argument("--names", metavar="FILE",
+                        dest='names_file', default=None,
+                        help="File with names (titles) of secret service entries, one per line, - means stdin")
+    parser.add_argument("--format",
+                        dest='format', default='plain', choices=['plain', 'json', 'export', 'env'],
+                        help="Output format, defaults to plain (secrets only, one per line)")
+    parser.add_argument("--agent",
+                        action="store_const", const=True, default=False,
+                        help="Run as agent caching secrets in memory")
+    parser.add_argument("--socket", metavar="PATH",
+                        dest='socket', default=default_socket_path(),
+                        help="Path to agent's socket, defaults to %s" % default_socket_path())
+    parser.add_argument("--ttl", metavar="SECONDS", type=int,
+                        dest='ttl', default=DEFAULT_AGENT_TTL,
+                        help="How long agent keeps secrets in cache, defaults to %d seconds" % DEFAULT_AGENT_TTL)
+    parser.add_argument("--flush",
+                        action="store_const", const=True, default=False,
+                        help="Remove all secrets from agent's cache")
     parser.add_argument("--debug",
                         action="store_const", const=True, default=False,
                         help="Enable debugging")
@@ -106,15 +612,34 @@ if __name__ == '__main__':
         sys.breakpointhook = breakpointhook
 
     try:
-        if options.secret is None:
-            raise Exception("Secret name not specified (missing --name option?)")
+        if options.agent:
+            run_agent(options.socket, options.ttl)
+            sys.exit(0)
+        if options.flush:
+            reply = agent_request({ 'op' : 'flush' }, options.socket)
+            log.info("Flushed %d secret(s)", reply['flushed'])
+            sys.exit(0)
+
+        names = list(options.secrets)
+        if options.names_file is not None:
+            names.extend(read_names(options.names_file))
+        if len(names) == 0:
+            raise Exception("Secret name not specified (missing --name or --names option?)")
 
-        secret = get_secret(options.secret)
+        secrets = None
+        if os.path.exists(options.socket):
+            try:
+                secrets = get_secrets_from_agent(names, options.socket)
+            except AgentUnavailable as e:
+                log.debug("%s, falling back to secret storage", e)
+        if secrets is None:
+            secrets = get_secrets(names)
+        output_string = format_secrets(secrets, options.format, names)
         if options.output == '-':
-            print(secret)
+            print(output_string)
         else:
             with open(options.output, 'w') as output:
-                output.write(secret)
+                output.write(output_string)
     except Exception as e:
         if options.debug:
             raise e
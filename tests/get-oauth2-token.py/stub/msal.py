@@ -0,0 +1,34 @@
+"""
+Stand-in for `msal` used by get-oauth2-token.py tests. Just enough to
+construct `MicrosoftO365`; tests replace its `_app` as needed. The
+default application always finds a valid access token in the cache.
+"""
+
+
+class SerializableTokenCache(object):
+    def __init__(self):
+        self.has_state_changed = False
+        self._state = ''
+
+    def deserialize(self, state):
+        self._state = state
+
+    def serialize(self):
+        return self._state
+
+    def find(self, credential_type):
+        return []
+
+
+class ConfidentialClientApplication(object):
+    def __init__(self, client_id, client_credential = None, authority = None, validate_authority = True, token_cache = None):
+        self.token_cache = token_cache
+
+    def get_accounts(self):
+        return []
+
+    def acquire_token_silent(self, scopes, account = None):
+        return { 'access_token' : 'stub-access-token', 'token_source' : 'cache' }
+
+    def acquire_token_by_refresh_token(self, refresh_token, scopes):
+        return { 'access_token' : 'stub-refreshed-token', 'token_source' : 'identity_provider' }
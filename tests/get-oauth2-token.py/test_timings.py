@@ -0,0 +1,184 @@
+"""
+Tests for get-oauth2-token.py timing instrumentation. `msal` is replaced
+by a stub (see stub/msal.py) and `MicrosoftO365._app` by `FakeApp`, so
+no network access is needed. Stage names are what
+get-oauth2-token-bench.py reports, keep them stable.
+"""
+
+import os
+import sys
+import json
+import subprocess
+import importlib.util
+
+import pytest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+STUB = os.path.join(TESTS, 'stub')
+SCRIPT = os.path.join(TESTS, '..', '..', 'get-oauth2-token.py')
+
+sys.path.insert(0, STUB)
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location('get_oauth2_token', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+get_oauth2_token = load_script()
+
+
+class FakeApp(object):
+    """
+    Fake msal application. acquire_token_silent() returns silent_reply,
+    acquire_token_by_refresh_token() returns refresh_reply.
+    """
+    def __init__(self, silent_reply, refresh_reply = None):
+        self.silent_reply = silent_reply
+        self.refresh_reply = refresh_reply
+        self.refresh_tokens = []
+
+    def get_accounts(self):
+        return [ { 'username' : 'john.doe@example.com' } ]
+
+    def acquire_token_silent(self, scopes, account = None):
+        return self.silent_reply
+
+    def acquire_token_by_refresh_token(self, refresh_token, scopes):
+        self.refresh_tokens.append(refresh_token)
+        return self.refresh_reply
+
+
+def provider(app, **kwargs):
+    timings = get_oauth2_token.Timings()
+    provider = get_oauth2_token.MicrosoftO365(timings = timings, **kwargs)
+    provider._app = app
+    return provider, timings
+
+
+def stage_names(timings):
+    return [ stage['stage'] for stage in timings.stages() ]
+
+
+#
+# Timings
+#
+
+def test_timings_stage():
+    timings = get_oauth2_token.Timings()
+    with timings.stage('one'):
+        pass
+    timings.record('two', 0.5)
+    assert stage_names(timings) == ['one', 'two']
+    assert timings.stages()[0]['seconds'] >= 0
+    assert json.loads(timings.as_json())['total'] == pytest.approx(0.5 + timings.stages()[0]['seconds'])
+
+
+def test_timings_write_appends(tmp_path):
+    output = str(tmp_path / 'timings.jsonl')
+    timings = get_oauth2_token.Timings()
+    timings.record('one', 1)
+    timings.write(output)
+    timings.write(output)
+    with open(output) as output_io:
+        lines = output_io.readlines()
+    assert len(lines) == 2
+    assert json.loads(lines[0]) == { 'stages' : [ { 'stage' : 'one', 'seconds' : 1 } ], 'total' : 1 }
+
+
+def test_timings_write_stderr(capsys):
+    timings = get_oauth2_token.Timings()
+    timings.record('one', 1)
+    timings.write('-')
+    assert json.loads(capsys.readouterr().err)['stages'] == [ { 'stage' : 'one', 'seconds' : 1 } ]
+
+
+def test_null_timings_records_nothing():
+    timings = get_oauth2_token.NullTimings()
+    with timings.stage('one'):
+        pass
+    timings.record('two', 1)
+    assert vars(timings) == {}
+
+
+def test_provider_defaults_to_null_timings():
+    provider = get_oauth2_token.MicrosoftO365()
+    assert isinstance(provider._timings, get_oauth2_token.NullTimings)
+    assert provider.get_token() == 'stub-access-token'
+
+
+#
+# Stages recorded by MicrosoftO365
+#
+
+def test_get_token_cache_hit():
+    app = FakeApp({ 'access_token' : 'cached', 'token_source' : 'cache' })
+    o365, timings = provider(app)
+    assert o365.get_token() == 'cached'
+    assert stage_names(timings) == ['app_init', 'acquire_token_silent']
+
+
+def test_get_token_silent_refresh():
+    app = FakeApp({ 'access_token' : 'refreshed', 'token_source' : 'identity_provider' })
+    o365, timings = provider(app)
+    assert o365.get_token() == 'refreshed'
+    assert stage_names(timings) == ['app_init', 'refresh_token_exchange']
+
+
+def test_get_token_silent_without_token_source():
+    # Older msal does not report token source
+    app = FakeApp({ 'access_token' : 'cached' })
+    o365, timings = provider(app)
+    assert o365.get_token() == 'cached'
+    assert stage_names(timings) == ['app_init', 'acquire_token_silent']
+
+
+def test_get_token_silent_miss():
+    app = FakeApp(None, { 'access_token' : 'refreshed' })
+    o365, timings = provider(app)
+    assert o365.get_token() == 'refreshed'
+    assert stage_names(timings) == ['app_init', 'acquire_token_silent', 'refresh_token_exchange']
+
+
+def test_get_token_by_refresh_token_in_secret(monkeypatch):
+    monkeypatch.setattr(get_oauth2_token, 'get_secrets',
+                        lambda secret_titles: { 'Token' : json.dumps({ 'refresh_token' : 'secret-refresh-token' }) })
+    app = FakeApp(None, { 'access_token' : 'refreshed' })
+    o365, timings = provider(app)
+    assert o365.get_token_by_refresh_token_in_secret('Token') == 'refreshed'
+    assert app.refresh_tokens == ['secret-refresh-token']
+    assert stage_names(timings) == ['app_init', 'secret_lookup', 'refresh_token_exchange']
+
+
+def test_token_cache_stages(tmp_path):
+    token_cache_file = str(tmp_path / 'cache.json')
+    with open(token_cache_file, 'w') as token_cache_io:
+        token_cache_io.write('{}')
+    app = FakeApp({ 'access_token' : 'cached', 'token_source' : 'cache' })
+    with provider(app, token_cache_file = token_cache_file)[0] as o365:
+        o365.get_token()
+        o365._token_cache.has_state_changed = True
+    assert stage_names(o365._timings) == ['cache_deserialize', 'app_init', 'acquire_token_silent', 'cache_serialize']
+
+
+#
+# Command line
+#
+
+def test_cli_writes_timings_at_exit(tmp_path):
+    token_cache_file = str(tmp_path / 'cache.json')
+    with open(token_cache_file, 'w') as token_cache_io:
+        token_cache_io.write('{}')
+    timings_file = str(tmp_path / 'timings.jsonl')
+    env = dict(os.environ, PYTHONPATH=STUB)
+    result = subprocess.run([sys.executable, SCRIPT, '--cache', token_cache_file, '--timings', timings_file],
+                            env=env, stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=30)
+    assert result.returncode == 0
+    assert result.stdout == 'stub-access-token\n'
+    with open(timings_file) as timings_io:
+        lines = timings_io.readlines()
+    assert len(lines) == 1
+    timings = json.loads(lines[0])
+    assert [ stage['stage'] for stage in timings['stages'] ] == ['startup', 'cache_deserialize', 'app_init', 'acquire_token_silent']
+    assert timings['total'] == pytest.approx(sum([ stage['seconds'] for stage in timings['stages'] ]))
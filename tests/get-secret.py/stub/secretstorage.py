@@ -0,0 +1,70 @@
+"""
+Stand-in for `secretstorage` used by get-secret.py tests. Secrets are
+taken from `SECRETS` or, if set, from JSON file named by environment
+variable `STUB_SECRETSTORAGE`.
+"""
+
+import os
+import json
+
+SECRETS = {}
+if os.getenv('STUB_SECRETSTORAGE') is not None:
+    with open(os.getenv('STUB_SECRETSTORAGE')) as secrets_io:
+        SECRETS = json.load(secrets_io)
+
+# Titles searched for, so tests can tell whether secret storage was asked
+SEARCHES = []
+
+# When set, search_items() raises it
+FAILURE = None
+
+# When set, search_items() sets BLOCKED and waits until BLOCK is set
+BLOCK = None
+BLOCKED = None
+
+# Whether collection is locked and whether user dismisses unlock prompt
+LOCKED = False
+UNLOCK_DISMISSED = False
+
+
+class SecretServiceNotAvailableException(Exception):
+    pass
+
+
+class Item(object):
+    def __init__(self, secret):
+        self._secret = secret
+
+    def get_secret(self):
+        return self._secret.encode('utf8')
+
+
+class Collection(object):
+    def is_locked(self):
+        return LOCKED
+
+    def unlock(self):
+        global LOCKED
+        if UNLOCK_DISMISSED:
+            return True
+        LOCKED = False
+        return False
+
+    def search_items(self, attributes):
+        if FAILURE is not None:
+            raise FAILURE
+        if BLOCK is not None:
+            BLOCKED.set()
+            BLOCK.wait()
+        SEARCHES.append(attributes['Title'])
+        if attributes['Title'] in SECRETS:
+            return [ Item(SECRETS[attributes['Title']]) ]
+        return []
+
+
+def dbus_init():
+    return None
+
+
+def get_default_collection(connection):
+    return Collection()
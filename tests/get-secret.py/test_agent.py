@@ -0,0 +1,237 @@
+"""
+Tests for get-secret.py agent. Secret storage is replaced by a stub
+(see stub/secretstorage.py) so no D-Bus session is needed.
+"""
+
+import os
+import sys
+import json
+import socket
+import threading
+import subprocess
+import importlib.util
+
+import pytest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+STUB = os.path.join(TESTS, 'stub')
+SCRIPT = os.path.join(TESTS, '..', '..', 'get-secret.py')
+
+sys.path.insert(0, STUB)
+import secretstorage
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location('get_secret', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+get_secret = load_script()
+
+
+@pytest.fixture
+def secrets(monkeypatch):
+    monkeypatch.setattr(secretstorage, 'SECRETS', { 'API Key' : 'k1', 'DB Password' : 'p1' })
+    monkeypatch.setattr(secretstorage, 'SEARCHES', [])
+    monkeypatch.setattr(secretstorage, 'FAILURE', None)
+    return secretstorage.SECRETS
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [ 1000.0 ]
+    monkeypatch.setattr(get_secret.time, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return str(tmp_path / 'agent' / 'agent.sock')
+
+
+@pytest.fixture
+def agent(secrets, socket_path):
+    agent = get_secret.SecretAgent(socket_path, ttl = 60)
+    thread = threading.Thread(target=agent.serve_forever, daemon=True)
+    thread.start()
+    yield agent
+    agent.shutdown()
+    agent.server_close()
+    thread.join()
+
+
+#
+# SecretCache
+#
+
+def test_cache_put_and_get(clock):
+    cache = get_secret.SecretCache(ttl = 10, size = 64)
+    cache.put('a', 'secret-a')
+    cache.put('b', 'secret-b')
+    assert cache.get('a') == 'secret-a'
+    assert cache.get('b') == 'secret-b'
+    assert cache.get('c') is None
+    assert len(cache) == 2
+
+
+def test_cache_expire(clock):
+    cache = get_secret.SecretCache(ttl = 10, size = 64)
+    cache.put('a', 'secret-a')
+    clock[0] += 5
+    cache.put('b', 'secret-b')
+    clock[0] += 6
+    assert cache.get('a') is None
+    assert cache.get('b') == 'secret-b'
+    clock[0] += 5
+    cache.expire()
+    assert len(cache) == 0
+    assert cache._buffer[:] == bytes(64)
+
+
+def test_cache_replace_and_compact(clock):
+    cache = get_secret.SecretCache(ttl = 10, size = 16)
+    cache.put('a', '12345678')
+    cache.put('b', 'abcd')
+    cache.put('a', 'xy')
+    # Does not fit without compaction
+    cache.put('c', 'ZZZZZZ')
+    assert cache.get('a') == 'xy'
+    assert cache.get('b') == 'abcd'
+    assert cache.get('c') == 'ZZZZZZ'
+    assert cache._used == 12
+    assert cache._buffer[12:] == bytes(4)
+
+
+def test_cache_full(clock):
+    cache = get_secret.SecretCache(ttl = 10, size = 8)
+    cache.put('a', '123456')
+    cache.put('b', '123456')
+    assert cache.get('a') == '123456'
+    assert cache.get('b') is None
+
+
+def test_cache_flush(clock):
+    cache = get_secret.SecretCache(ttl = 10, size = 64)
+    cache.put('a', 'secret-a')
+    cache.flush()
+    assert len(cache) == 0
+    assert cache.get('a') is None
+    assert cache._buffer[:] == bytes(64)
+
+
+#
+# SecretAgent
+#
+
+def test_agent_socket_permissions(agent, socket_path):
+    assert os.stat(socket_path).st_mode & 0o777 == 0o600
+    assert os.stat(os.path.dirname(socket_path)).st_mode & 0o777 == 0o700
+
+
+def test_agent_get_secrets(agent, socket_path):
+    assert get_secret.get_secrets_from_agent(['API Key', 'DB Password'], socket_path) == { 'API Key' : 'k1', 'DB Password' : 'p1' }
+    assert secretstorage.SEARCHES == ['API Key', 'DB Password']
+    # Second lookup is served from cache
+    assert get_secret.get_secrets_from_agent(['DB Password'], socket_path) == { 'DB Password' : 'p1' }
+    assert secretstorage.SEARCHES == ['API Key', 'DB Password']
+
+
+def test_agent_no_such_secret(agent, socket_path):
+    with pytest.raises(get_secret.NoSuchSecretError) as e:
+        get_secret.get_secrets_from_agent(['API Key', 'Nope'], socket_path)
+    assert e.value.secret_titles == ['Nope']
+
+
+def test_agent_flush(agent, socket_path):
+    get_secret.get_secrets_from_agent(['API Key'], socket_path)
+    assert get_secret.agent_request({ 'op' : 'flush' }, socket_path) == { 'flushed' : 1 }
+    get_secret.get_secrets_from_agent(['API Key'], socket_path)
+    assert secretstorage.SEARCHES == ['API Key', 'API Key']
+
+
+def test_agent_secret_storage_failure(agent, socket_path, monkeypatch):
+    monkeypatch.setattr(secretstorage, 'FAILURE', secretstorage.SecretServiceNotAvailableException("gone"))
+    with pytest.raises(get_secret.AgentUnavailable):
+        get_secret.get_secrets_from_agent(['API Key'], socket_path)
+
+
+def test_agent_idle_client_does_not_block_others(agent, socket_path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as idle:
+        idle.connect(socket_path)
+        assert get_secret.get_secrets_from_agent(['API Key'], socket_path, timeout = 1) == { 'API Key' : 'k1' }
+
+
+def test_agent_serves_cached_while_fetching(agent, socket_path, monkeypatch):
+    get_secret.get_secrets_from_agent(['API Key'], socket_path)
+    monkeypatch.setattr(secretstorage, 'BLOCK', threading.Event())
+    monkeypatch.setattr(secretstorage, 'BLOCKED', threading.Event())
+    fetched = {}
+    fetching = threading.Thread(target=lambda: fetched.update(get_secret.get_secrets_from_agent(['DB Password'], socket_path)))
+    fetching.start()
+    try:
+        assert secretstorage.BLOCKED.wait(5)
+        # Secret storage lookup is stuck, yet cached secret is served
+        assert get_secret.get_secrets_from_agent(['API Key'], socket_path, timeout = 1) == { 'API Key' : 'k1' }
+    finally:
+        secretstorage.BLOCK.set()
+        fetching.join()
+    assert fetched == { 'DB Password' : 'p1' }
+    assert secretstorage.SEARCHES == ['API Key', 'DB Password']
+
+
+def test_agent_refuses_other_users(agent, socket_path, monkeypatch):
+    monkeypatch.setattr(agent, 'verify_request', lambda request, client_address: False)
+    with pytest.raises(get_secret.AgentUnavailable):
+        get_secret.get_secrets_from_agent(['API Key'], socket_path)
+
+
+def test_agent_already_running(agent, socket_path):
+    with pytest.raises(Exception, match="already running"):
+        get_secret.SecretAgent(socket_path)
+
+
+def test_agent_removes_stale_socket(secrets, socket_path):
+    os.makedirs(os.path.dirname(socket_path), mode=0o700)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(socket_path)
+    with get_secret.SecretAgent(socket_path):
+        assert os.path.exists(socket_path)
+    assert not os.path.exists(socket_path)
+
+
+def test_agent_not_replying(socket_path):
+    os.makedirs(os.path.dirname(socket_path), mode=0o700)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stuck:
+        stuck.bind(socket_path)
+        stuck.listen()
+        with pytest.raises(get_secret.AgentUnavailable):
+            get_secret.get_secrets_from_agent(['API Key'], socket_path, timeout = 0.5)
+
+
+#
+# Command line
+#
+
+def run_script(tmp_path, *args):
+    secrets_file = tmp_path / 'secrets.json'
+    secrets_file.write_text(json.dumps({ 'API Key' : 'k1' }))
+    env = dict(os.environ, PYTHONPATH=STUB, STUB_SECRETSTORAGE=str(secrets_file))
+    return subprocess.run([sys.executable, SCRIPT] + list(args), env=env,
+                          capture_output=True, text=True, timeout=30)
+
+
+def test_cli_falls_back_when_agent_stuck(tmp_path, socket_path):
+    os.makedirs(os.path.dirname(socket_path), mode=0o700)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stuck:
+        stuck.bind(socket_path)
+        stuck.listen()
+        result = run_script(tmp_path, '--socket', socket_path, '--name', 'API Key')
+    assert result.returncode == 0
+    assert result.stdout == 'k1\n'
+
+
+def test_cli_no_such_secret(tmp_path, socket_path):
+    result = run_script(tmp_path, '--socket', socket_path, '--name', 'Nope')
+    assert result.returncode == 1
+    assert 'No such secret: Nope' in result.stderr
@@ -0,0 +1,125 @@
+"""
+Tests for get-secret.py batch lookup and output formats. Secret storage
+is replaced by a stub (see stub/secretstorage.py).
+"""
+
+import io
+import os
+import sys
+import importlib.util
+
+import pytest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+STUB = os.path.join(TESTS, 'stub')
+SCRIPT = os.path.join(TESTS, '..', '..', 'get-secret.py')
+
+sys.path.insert(0, STUB)
+import secretstorage
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location('get_secret', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+get_secret = load_script()
+
+
+@pytest.fixture
+def secrets(monkeypatch):
+    monkeypatch.setattr(secretstorage, 'SECRETS', { 'API Key' : 'k1', 'DB Password' : 'p1' })
+    monkeypatch.setattr(secretstorage, 'SEARCHES', [])
+    monkeypatch.setattr(secretstorage, 'FAILURE', None)
+    monkeypatch.setattr(secretstorage, 'LOCKED', False)
+    monkeypatch.setattr(secretstorage, 'UNLOCK_DISMISSED', False)
+    return secretstorage.SECRETS
+
+
+#
+# get_secrets()
+#
+
+def test_get_secrets(secrets):
+    assert get_secret.get_secrets(['API Key', 'DB Password', 'API Key']) == { 'API Key' : 'k1', 'DB Password' : 'p1' }
+    assert secretstorage.SEARCHES == ['API Key', 'DB Password']
+
+
+def test_get_secrets_missing(secrets):
+    with pytest.raises(get_secret.NoSuchSecretError) as e:
+        get_secret.get_secrets(['Nope', 'API Key', 'Neither'])
+    assert e.value.secret_titles == ['Nope', 'Neither']
+
+
+def test_get_secrets_unlocks(secrets, monkeypatch):
+    monkeypatch.setattr(secretstorage, 'LOCKED', True)
+    assert get_secret.get_secrets(['API Key']) == { 'API Key' : 'k1' }
+    assert secretstorage.LOCKED is False
+
+
+def test_get_secrets_unlock_dismissed(secrets, monkeypatch):
+    monkeypatch.setattr(secretstorage, 'LOCKED', True)
+    monkeypatch.setattr(secretstorage, 'UNLOCK_DISMISSED', True)
+    with pytest.raises(Exception, match="unlock prompt dismissed"):
+        get_secret.get_secrets(['API Key'])
+    assert secretstorage.SEARCHES == []
+
+
+#
+# read_names()
+#
+
+def test_read_names(tmp_path):
+    names_file = tmp_path / 'names.txt'
+    names_file.write_text("API Key\n\n# comment\n  DB Password  \n")
+    assert get_secret.read_names(str(names_file)) == ['API Key', 'DB Password']
+
+
+def test_read_names_stdin(monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO("API Key\n#DB Password\n"))
+    assert get_secret.read_names('-') == ['API Key']
+
+
+#
+# Variable names and formats
+#
+
+def test_variable_name():
+    assert get_secret.variable_name('API Key') == 'API_KEY'
+    assert get_secret.variable_name('db-password.prod') == 'DB_PASSWORD_PROD'
+    assert get_secret.variable_name('1st Token') == '_1ST_TOKEN'
+    assert get_secret.variable_name('') == '_'
+
+
+def test_variables_clash():
+    with pytest.raises(Exception, match="API Key and API-Key"):
+        get_secret.variables({ 'API Key' : 'k1', 'API-Key' : 'k2', 'DB Password' : 'p1' })
+
+
+def test_format_plain():
+    secrets = { 'A' : 'a', 'B' : 'b' }
+    assert get_secret.format_secrets(secrets, 'plain') == 'a\nb'
+    assert get_secret.format_secrets(secrets, 'plain', ['A', 'A', 'B']) == 'a\na\nb'
+
+
+def test_format_json():
+    assert get_secret.format_secrets({ 'A' : 'a' }, 'json') == '{\n  "A": "a"\n}'
+
+
+def test_format_export():
+    assert get_secret.format_secrets({ 'API Key' : "it's" }, 'export') == "export API_KEY='it'\"'\"'s'"
+
+
+def test_format_export_clash():
+    with pytest.raises(Exception, match="same variable name"):
+        get_secret.format_secrets({ 'API Key' : 'k1', 'API-Key' : 'k2' }, 'export')
+
+
+def test_format_env():
+    assert get_secret.format_secrets({ 'API Key' : 'k1', 'DB Password' : 'p1' }, 'env') == 'API_KEY=k1\nDB_PASSWORD=p1'
+
+
+def test_format_env_newline():
+    with pytest.raises(Exception, match="contains newline"):
+        get_secret.format_secrets({ 'API Key' : 'k\n1' }, 'env')